@@ -0,0 +1,5 @@
+"""Shared Rich console used for all CLI output."""
+
+from rich.console import Console
+
+console = Console()
@@ -0,0 +1,132 @@
+"""Persistent key-value cache backed by SQLite."""
+
+import contextlib
+import hashlib
+import json
+import mmap
+import sqlite3
+import threading
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+
+def make_cache_key(**parts: Any) -> str:
+    """
+    Build a stable cache key from JSON-serializable parts.
+    
+    Args:
+        **parts: Values that together identify a cached result
+    
+    Returns:
+        Hex-encoded SHA-256 digest of the canonical JSON encoding
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@contextlib.contextmanager
+def map_file(path: Path) -> Iterator[mmap.mmap | bytes]:
+    """
+    Map a file read-only into memory, e.g. for hashing its content.
+    
+    The pages are shared with the OS page cache instead of being copied
+    into a Python bytes object.
+    
+    Args:
+        path: File to map
+    
+    Yields:
+        The mapped content (``b""`` for an empty file, which cannot be mapped)
+    """
+    with open(path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+class DiskCache:
+    """Thread-safe cache of strings or bytes persisted in a SQLite file."""
+    
+    def __init__(self, path: Path):
+        """
+        Open (or create) the cache.
+        
+        Args:
+            path: SQLite database file
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+    
+    def get(self, key: str) -> str | bytes | None:
+        """
+        Look up a cached value.
+        
+        Args:
+            key: Cache key
+        
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def set(self, key: str, value: str | bytes) -> None:
+        """
+        Store a value, replacing any existing entry.
+        
+        Args:
+            key: Cache key
+            value: Value to store
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+                (key, value),
+            )
+    
+    def get_many(self, keys: list[str]) -> dict[str, str | bytes]:
+        """
+        Look up several cached values at once.
+        
+        Args:
+            keys: Cache keys
+        
+        Returns:
+            Mapping of the keys that were found to their values
+        """
+        found: dict[str, str | bytes] = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({placeholders})",
+                    batch,
+                ))
+        return found
+    
+    def set_many(self, items: Iterable[tuple[str, str | bytes]]) -> None:
+        """
+        Store several values in a single transaction.
+        
+        Args:
+            items: (key, value) pairs to store
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+                items,
+            )
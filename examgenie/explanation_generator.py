@@ -1,14 +1,56 @@
 """Generate detailed explanations for topics."""
 
-import json
-from rich.console import Console
+import asyncio
+import os
+import re
+from collections import deque
+from typing import Final
+
+import ahocorasick
+import orjson
 from rich.progress import Progress, SpinnerColumn, TextColumn
 
+from ._console import console
+from .json_utils import extract_json
 from .llm_client import LLMClient
 from .models import Explanation, ExampleQuestion, Topic, ExamDocument
 from .rag_system import RAGSystem
+from .tokens import count_tokens
+
+_SYSTEM_PROMPT: Final[str] = """You are an expert educator creating comprehensive study materials. Your task is to provide detailed, intuitive explanations of academic topics.
+
+For each topic, provide:
+1. A thorough explanation of the concept
+2. Key concepts and principles to remember
+3. Intuitive examples and analogies to aid understanding
+4. Practical applications when relevant
+
+Make your explanations clear, engaging, and accessible. Use analogies and real-world examples to make complex concepts easier to grasp."""
+
+_JSON_SCHEMA_HINT: Final[str] = """
+
+Provide a detailed explanation in JSON format:
+{
+  "explanation": "Detailed explanation text",
+  "key_concepts": ["concept1", "concept2", ...],
+  "examples": ["example1", "example2", ...]
+}
+
+Return ONLY the JSON object, no additional text."""
 
-console = Console()
+# Number of related exam questions shown per topic
+_MAX_RELATED_QUESTIONS = 3
+
+# Split points between sentences, used when trimming reference material
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+def _is_explanation_response(response: str) -> bool:
+    """Check whether an explanation response holds a JSON object, so it is safe to cache."""
+    try:
+        return isinstance(orjson.loads(extract_json(response)), dict)
+    except orjson.JSONDecodeError:
+        return False
 
 
 class ExplanationGenerator:
@@ -24,62 +66,212 @@ class ExplanationGenerator:
         """
         self.llm_client = llm_client
         self.rag_system = rag_system
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.max_context_tokens = int(os.getenv("RAG_CTX_TOKENS", "1500"))
+        self._question_index: list[tuple[ExampleQuestion, set[str]]] = []
+        self._indexed_docs: list[ExamDocument] | None = None
+        self._indexed_keywords: set[str] = set()
+        self._rag_results: dict[str, list[str]] = {}
     
-    def _find_related_questions(
+    def _prepare_questions(
         self,
-        topic_name: str,
         exam_docs: list[ExamDocument],
-    ) -> list[ExampleQuestion]:
+    ) -> dict[str, list[tuple[str, str]]]:
+        """
+        Case-fold every exam question once.
+        
+        Args:
+            exam_docs: List of exam documents
+            
+        Returns:
+            Mapping of filename to (question, lowercased question) pairs
+        """
+        return {
+            doc.filename: [
+                (question_text, question_text.lower())
+                for question_text in doc.questions
+            ]
+            for doc in exam_docs
+        }
+    
+    def _index_questions(self, topics: list[Topic], exam_docs: list[ExamDocument]) -> None:
+        """
+        Record which topic keywords occur in each exam question.
+        
+        All keywords are compiled into a single Aho-Corasick automaton, so every
+        question is scanned once instead of once per topic and keyword.
+        
+        Args:
+            topics: List of hierarchical topics
+            exam_docs: List of exam documents
+        """
+        self._question_index = []
+        
+        keywords = {
+            keyword
+            for topic, _ in self._flatten_topics(topics)
+            for keyword in topic.name.lower().split()
+        }
+        self._indexed_docs = exam_docs
+        self._indexed_keywords = keywords
+        if not keywords:
+            return
+        
+        automaton = ahocorasick.Automaton()
+        for keyword in keywords:
+            automaton.add_word(keyword, keyword)
+        automaton.make_automaton()
+        
+        for filename, questions in self._prepare_questions(exam_docs).items():
+            for question_text, question_lower in questions:
+                keywords_hit = {keyword for _, keyword in automaton.iter(question_lower)}
+                if keywords_hit:
+                    self._question_index.append((
+                        ExampleQuestion(question=question_text, source_file=filename),
+                        keywords_hit,
+                    ))
+    
+    def _find_related_questions(self, topic_name: str) -> list[ExampleQuestion]:
         """
         Find exam questions related to a topic.
         
+        Relies on the keyword index built by ``_index_questions``.
+        
         Args:
             topic_name: Name of the topic
-            exam_docs: List of exam documents
             
         Returns:
             List of related example questions
         """
         # Simple keyword matching for now
         # Could be enhanced with semantic search
+        topic_keywords = set(topic_name.lower().split())
+        
         questions: list[ExampleQuestion] = []
         
-        topic_keywords = topic_name.lower().split()
+        for question, keywords_hit in self._question_index:
+            if not topic_keywords.isdisjoint(keywords_hit):
+                questions.append(question)
+                # Stop scanning once the top 3 related questions are found
+                if len(questions) >= _MAX_RELATED_QUESTIONS:
+                    break
+        
+        return questions
+    
+    def _flatten_topics(self, topics: list[Topic]) -> list[tuple[Topic, str]]:
+        """
+        Flatten the topic tree into (topic, parent_context) pairs.
         
-        for doc in exam_docs:
-            # Split document into potential questions (simple heuristic)
-            lines = doc.text.split('\n')
-            current_question = []
+        Args:
+            topics: List of hierarchical topics
+            
+        Returns:
+            Pairs in document order, each with its ancestors' topic path
+        """
+        pairs: list[tuple[Topic, str]] = []
+        stack = deque((topic, "") for topic in reversed(topics))
+        
+        while stack:
+            topic, parent_context = stack.pop()
+            pairs.append((topic, parent_context))
+            topic_path = f"{parent_context} > {topic.name}" if parent_context else topic.name
             
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    if current_question:
-                        question_text = ' '.join(current_question)
-                        # Check if question relates to topic
-                        if any(keyword in question_text.lower() for keyword in topic_keywords):
-                            questions.append(ExampleQuestion(
-                                question=question_text,
-                                source_file=doc.filename,
-                            ))
-                        current_question = []
-                else:
-                    current_question.append(line)
-        
-        return questions[:3]  # Return top 3 related questions
+            # Reversed so subtopics are popped in document order
+            stack.extend((subtopic, topic_path) for subtopic in reversed(topic.subtopics))
+        
+        return pairs
     
-    def generate_explanation(
+    def _search_topic_names(self, topics: list[Topic]) -> None:
+        """
+        Retrieve reference material for every topic name in one batched search.
+        
+        Args:
+            topics: List of hierarchical topics
+        """
+        self._rag_results = {}
+        if not self.rag_system:
+            return
+        
+        topic_names = list(dict.fromkeys(topic.name for topic, _ in self._flatten_topics(topics)))
+        try:
+            results = self.rag_system.search_many(topic_names, top_k=3)
+        except Exception as e:
+            # Fall back to searching each topic on demand
+            console.print(f"[yellow]⚠[/yellow] Batch search failed: {e}")
+            return
+        
+        self._rag_results = dict(zip(topic_names, results))
+    
+    def _trim_rag_context(self, chunks: list[str]) -> str:
+        """
+        Join reference chunks while staying within ``max_context_tokens``.
+        
+        Shorter prompts mean less prefill work per request. The chunk that
+        crosses the budget is cut at a sentence boundary; later chunks are dropped.
+        
+        Args:
+            chunks: Retrieved chunks, most relevant first
+            
+        Returns:
+            Reference material for the prompt
+        """
+        kept: list[str] = []
+        remaining = self.max_context_tokens
+        
+        for chunk in chunks:
+            chunk_tokens = count_tokens(chunk)
+            if chunk_tokens <= remaining:
+                kept.append(chunk)
+                remaining -= chunk_tokens
+                continue
+            
+            # Fill the rest of the budget with whole sentences
+            sentences: list[str] = []
+            for sentence in _SENTENCE_BOUNDARY.split(chunk):
+                sentence_tokens = count_tokens(sentence)
+                if sentence_tokens > remaining:
+                    break
+                sentences.append(sentence)
+                remaining -= sentence_tokens
+            
+            if sentences:
+                kept.append(" ".join(sentences))
+            break
+        
+        return "\n\n".join(kept)
+    
+    def _get_rag_context(self, topic: Topic) -> str:
+        """Retrieve reference material for a topic, if RAG is enabled."""
+        if not self.rag_system:
+            return ""
+        
+        try:
+            relevant_chunks = self._rag_results.get(topic.name)
+            if relevant_chunks is None:
+                relevant_chunks = self.rag_system.search(topic.name, top_k=3)
+            if relevant_chunks:
+                return self._trim_rag_context(relevant_chunks)
+        except Exception:
+            pass  # RAG is optional
+        
+        return ""
+    
+    async def generate_explanation(
         self,
         topic: Topic,
-        exam_docs: list[ExamDocument],
+        exam_docs: list[ExamDocument] | None = None,
         parent_context: str = "",
     ) -> Explanation:
         """
         Generate detailed explanation for a topic.
         
+        Related exam questions come from the keyword index, which is rebuilt
+        for ``exam_docs`` unless it already covers them and this topic.
+        
         Args:
             topic: Topic to explain
-            exam_docs: List of exam documents for context
+            exam_docs: List of exam documents for context (defaults to the
+                documents indexed by ``generate_all_explanations``)
             parent_context: Context from parent topics
             
         Returns:
@@ -88,67 +280,37 @@ class ExplanationGenerator:
         # Build context
         topic_path = f"{parent_context} > {topic.name}" if parent_context else topic.name
         
-        # Get RAG context if available
-        rag_context = ""
-        if self.rag_system:
-            try:
-                relevant_chunks = self.rag_system.search(topic.name, top_k=3)
-                if relevant_chunks:
-                    rag_context = "\n\n".join(relevant_chunks)
-            except Exception:
-                pass  # RAG is optional
+        if exam_docs is not None and (
+            exam_docs is not self._indexed_docs
+            or not self._indexed_keywords.issuperset(topic.name.lower().split())
+        ):
+            self._index_questions([topic], exam_docs)
         
-        # Create prompt
-        system_prompt = """You are an expert educator creating comprehensive study materials. Your task is to provide detailed, intuitive explanations of academic topics.
-
-For each topic, provide:
-1. A thorough explanation of the concept
-2. Key concepts and principles to remember
-3. Intuitive examples and analogies to aid understanding
-4. Practical applications when relevant
-
-Make your explanations clear, engaging, and accessible. Use analogies and real-world examples to make complex concepts easier to grasp."""
-
-        user_prompt = f"""Topic: {topic_path}
-Description: {topic.description}"""
-
+        # Look up related questions before awaiting, while the index matches this topic
+        related_questions = self._find_related_questions(topic.name)
+        
+        # Get RAG context if available (search is blocking, so run it off the event loop)
+        rag_context = await asyncio.to_thread(self._get_rag_context, topic)
+        
+        # Create prompt; only the topic-specific parts are built per call
+        user_prompt = f"Topic: {topic_path}\nDescription: {topic.description}"
         if rag_context:
-            user_prompt += f"""
-
-Reference Material:
-{rag_context}"""
-
-        user_prompt += """
-
-Provide a detailed explanation in JSON format:
-{
-  "explanation": "Detailed explanation text",
-  "key_concepts": ["concept1", "concept2", ...],
-  "examples": ["example1", "example2", ...]
-}
-
-Return ONLY the JSON object, no additional text."""
-
+            user_prompt += f"\n\nReference Material:\n{rag_context}"
+        user_prompt += _JSON_SCHEMA_HINT
+        
         # Call LLM
-        response = self.llm_client.chat_completion(
+        response = await self.llm_client.achat_completion(
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": _SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt},
             ],
             temperature=0.7,
+            validate=_is_explanation_response,
         )
         
         # Parse response
         try:
-            # Extract JSON from response
-            json_start = response.find("{")
-            json_end = response.rfind("}") + 1
-            json_str = response[json_start:json_end]
-            
-            data = json.loads(json_str)
-            
-            # Find related questions
-            related_questions = self._find_related_questions(topic.name, exam_docs)
+            data = orjson.loads(extract_json(response))
             
             return Explanation(
                 topic_name=topic_path,
@@ -158,7 +320,7 @@ Return ONLY the JSON object, no additional text."""
                 related_questions=related_questions,
             )
         
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             console.print(f"[yellow]⚠[/yellow] Failed to parse explanation JSON for {topic.name}: {e}")
             # Return basic explanation
             return Explanation(
@@ -169,13 +331,17 @@ Return ONLY the JSON object, no additional text."""
                 related_questions=[],
             )
     
-    def generate_all_explanations(
+    async def generate_all_explanations(
         self,
         topics: list[Topic],
         exam_docs: list[ExamDocument],
     ) -> dict[str, Explanation]:
         """
-        Generate explanations for all topics and subtopics.
+        Generate explanations for all topics and subtopics concurrently.
+        
+        At most ``max_concurrency`` requests (``LLM_MAX_CONCURRENCY`` env var)
+        are in flight at once to stay within provider rate limits. Topics
+        sharing a name and description are generated once and reused.
         
         Args:
             topics: List of hierarchical topics
@@ -184,19 +350,23 @@ Return ONLY the JSON object, no additional text."""
         Returns:
             Dictionary mapping topic paths to explanations
         """
-        explanations: dict[str, Explanation] = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
         
-        def process_topic(topic: Topic, parent_context: str = ""):
+        async def process_topic(topic: Topic, parent_context: str) -> Explanation:
             topic_path = f"{parent_context} > {topic.name}" if parent_context else topic.name
             
-            console.print(f"[cyan]→[/cyan] Generating explanation for: {topic_path}")
-            
-            explanation = self.generate_explanation(topic, exam_docs, parent_context)
-            explanations[topic_path] = explanation
-            
-            # Process subtopics
-            for subtopic in topic.subtopics:
-                process_topic(subtopic, topic_path)
+            async with semaphore:
+                console.print(f"[cyan]→[/cyan] Generating explanation for: {topic_path}")
+                return await self.generate_explanation(topic, exam_docs, parent_context)
+        
+        self._index_questions(topics, exam_docs)
+        await asyncio.to_thread(self._search_topic_names, topics)
+        
+        # Coalesce repeated (name, description) pairs into a single request
+        flat_topics = self._flatten_topics(topics)
+        unique_topics: dict[tuple[str, str], tuple[Topic, str]] = {}
+        for topic, parent_context in flat_topics:
+            unique_topics.setdefault((topic.name, topic.description), (topic, parent_context))
         
         with Progress(
             SpinnerColumn(),
@@ -205,8 +375,24 @@ Return ONLY the JSON object, no additional text."""
         ) as progress:
             task = progress.add_task("[cyan]Generating explanations...", total=None)
             
-            for topic in topics:
-                process_topic(topic)
+            results = await asyncio.gather(*[
+                process_topic(topic, parent_context)
+                for topic, parent_context in unique_topics.values()
+            ])
+        
+        generated = dict(zip(unique_topics, results))
         
-        console.print(f"[green]✓[/green] Generated {len(explanations)} explanations")
+        # Fan each generated explanation out to every path it applies to
+        explanations: dict[str, Explanation] = {}
+        for topic, parent_context in flat_topics:
+            topic_path = f"{parent_context} > {topic.name}" if parent_context else topic.name
+            explanation = generated[(topic.name, topic.description)]
+            if explanation.topic_name != topic_path:
+                explanation = explanation.model_copy(update={"topic_name": topic_path})
+            explanations[topic_path] = explanation
+        
+        console.print(
+            f"[green]✓[/green] Generated {len(explanations)} explanations "
+            f"({len(unique_topics)} LLM requests)"
+        )
         return explanations
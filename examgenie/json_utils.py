@@ -0,0 +1,63 @@
+"""Helpers for pulling JSON payloads out of LLM responses."""
+
+import re
+
+# Characters that affect bracket matching: brackets, quotes and escapes
+_JSON_TOKEN = re.compile(r'[{}\[\]"\\]')
+
+_CLOSING = {"{": "}", "[": "]"}
+
+
+def extract_json(text: str, opening: str = "{") -> bytes:
+    """
+    Extract the first complete JSON object or array from an LLM response.
+    
+    Skips a leading Markdown code fence and matches brackets while ignoring
+    any that appear inside string literals, so surrounding prose or braces
+    in string values do not corrupt the slice.
+    
+    Args:
+        text: Raw response text
+        opening: Opening bracket of the expected value ("{" or "[")
+    
+    Returns:
+        UTF-8 encoded JSON, ready for ``orjson.loads``. If no complete value
+        is found, the (possibly empty) remainder is returned so parsing fails
+        with a regular decode error.
+    """
+    closing = _CLOSING[opening]
+    
+    # Skip an opening ```json fence
+    stripped = text.lstrip()
+    if stripped.startswith("```"):
+        text = stripped[stripped.find("\n") + 1:]
+    
+    start = text.find(opening)
+    if start == -1:
+        return b""
+    
+    depth = 0
+    in_string = False
+    skip_until = -1
+    
+    for match in _JSON_TOKEN.finditer(text, start):
+        pos = match.start()
+        if pos < skip_until:
+            continue  # Escaped character
+        
+        char = match.group()
+        if in_string:
+            if char == "\\":
+                skip_until = pos + 2
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == opening:
+            depth += 1
+        elif char == closing:
+            depth -= 1
+            if depth == 0:
+                return text[start:pos + 1].encode()
+    
+    return text[start:].encode()
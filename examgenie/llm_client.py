@@ -1,42 +1,222 @@
 """OpenRouter LLM client for ExamGenie."""
 
 import os
+import time
+from collections.abc import Callable
+from email.utils import parsedate_to_datetime
+from pathlib import Path
 from typing import Any
 
-from openai import OpenAI
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
-from rich.console import Console
+from tenacity import (
+    RetryCallState,
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+
+from ._console import console
+from .cache import DiskCache, make_cache_key
 
 # Load environment variables
 load_dotenv()
 
-console = Console()
+# API errors worth retrying: rate limits, timeouts, dropped connections, 5xx
+_TRANSIENT_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def _log_retry(retry_state: RetryCallState) -> None:
+    """Report a transient API failure before backing off."""
+    error = retry_state.outcome.exception()
+    console.print(f"[dim]↻ Transient API error (attempt {retry_state.attempt_number}), retrying: {error}[/dim]")
+
+
+# Longest server-requested delay honoured before retrying
+_MAX_RETRY_AFTER = 300.0
+
+_backoff = wait_exponential_jitter(initial=1, max=30)
+
+
+def _retry_after(error: BaseException | None) -> float | None:
+    """Read the delay requested by a response's Retry-After header, in seconds."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    
+    try:
+        delay = float(value)
+    except ValueError:
+        # The header may also hold an HTTP date
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    
+    return min(max(delay, 0.0), _MAX_RETRY_AFTER)
+
+
+def _wait_for_retry(retry_state: RetryCallState) -> float:
+    """Wait as long as the server asks, or back off exponentially with jitter."""
+    delay = _retry_after(retry_state.outcome.exception())
+    return delay if delay is not None else _backoff(retry_state)
+
+
+# Exponential backoff with jitter, so one 429 doesn't abort the whole run;
+# a Retry-After header from the server takes precedence
+_retry_transient = retry(
+    wait=_wait_for_retry,
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type(_TRANSIENT_ERRORS),
+    before_sleep=_log_retry,
+    reraise=True,
+)
 
 
 class LLMClient:
     """Client for interacting with OpenRouter API."""
     
-    def __init__(self):
-        """Initialize the LLM client."""
+    def __init__(self, cache_dir: Path = Path(".examgenie_cache/llm"), bypass_cache: bool = False):
+        """
+        Initialize the LLM client.
+        
+        Args:
+            cache_dir: Directory for cached responses
+            bypass_cache: If True, never answer requests from the cache
+        """
         self.api_key = os.getenv("OPENROUTER_API_KEY")
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY environment variable not set")
         
         self.model = os.getenv("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet")
         
-        # Initialize OpenAI client pointing to OpenRouter
+        # Shared connection pools; HTTP/2 lets concurrent requests multiplex
+        # over one connection instead of paying a TLS handshake each
+        max_connections = int(os.getenv("LLM_MAX_CONN", "64"))
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        timeout = httpx.Timeout(600.0, connect=10.0)
+        self._http = httpx.Client(http2=True, limits=limits, timeout=timeout)
+        self._ahttp = httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+        
+        # Initialize OpenAI clients pointing to OpenRouter
         self.client = OpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=self.api_key,
+            http_client=self._http,
+            max_retries=0,  # Retries are handled by _retry_transient
         )
+        self.aclient = AsyncOpenAI(
+            base_url="https://openrouter.ai/api/v1",
+            api_key=self.api_key,
+            http_client=self._ahttp,
+            max_retries=0,  # Retries are handled by _retry_transient
+        )
+        
+        # Identical requests are answered from disk instead of the API
+        self.cache = DiskCache(cache_dir / "cache.sqlite")
+        self.bypass_cache = bypass_cache
         
         console.print(f"[green]✓[/green] LLM client initialized with model: {self.model}")
     
+    def _completion_cache_key(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float,
+        max_tokens: int | None,
+    ) -> str:
+        """Build the cache key identifying a chat completion request."""
+        return make_cache_key(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+    
+    def _cached_completion(
+        self,
+        cache_key: str,
+        bypass_cache: bool,
+        validate: Callable[[str], bool] | None,
+    ) -> str | None:
+        """Look up a cached response, ignoring entries that fail validation."""
+        if bypass_cache or self.bypass_cache:
+            return None
+        
+        cached = self.cache.get(cache_key)
+        if cached is None or (validate is not None and not validate(cached)):
+            return None
+        return cached
+    
+    def _store_completion(
+        self,
+        cache_key: str,
+        content: str,
+        validate: Callable[[str], bool] | None,
+    ) -> None:
+        """Cache a response, unless it is empty or fails validation."""
+        # A malformed response would otherwise be replayed on every run
+        if content and (validate is None or validate(content)):
+            self.cache.set(cache_key, content)
+    
+    @_retry_transient
+    def _create_completion(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float,
+        max_tokens: int | None,
+    ) -> str:
+        """Call the chat completions API, retrying transient failures."""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content or ""
+    
+    @_retry_transient
+    async def _acreate_completion(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float,
+        max_tokens: int | None,
+    ) -> str:
+        """Call the chat completions API asynchronously, retrying transient failures."""
+        response = await self.aclient.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content or ""
+    
+    @_retry_transient
+    def _create_embeddings(self, model: str, texts: list[str]) -> Any:
+        """Call the embeddings API, retrying transient failures."""
+        return self.client.embeddings.create(model=model, input=texts)
+    
     def chat_completion(
         self,
         messages: list[dict[str, str]],
         temperature: float = 0.7,
         max_tokens: int | None = None,
+        bypass_cache: bool = False,
+        validate: Callable[[str], bool] | None = None,
     ) -> str:
         """
         Send a chat completion request.
@@ -45,21 +225,60 @@ class LLMClient:
             messages: List of message dictionaries with 'role' and 'content'
             temperature: Sampling temperature (0-2)
             max_tokens: Maximum tokens to generate
+            bypass_cache: If True, always query the API (the result is still cached)
+            validate: Check that the response is usable, e.g. that it parses;
+                responses failing it are returned but never cached
+            
+        Returns:
+            The assistant's response text
+        """
+        cache_key = self._completion_cache_key(messages, temperature, max_tokens)
+        if (cached := self._cached_completion(cache_key, bypass_cache, validate)) is not None:
+            return cached
+        
+        try:
+            content = self._create_completion(messages, temperature, max_tokens)
+        except Exception as e:
+            console.print(f"[red]✗[/red] LLM API error: {e}")
+            raise
+        
+        self._store_completion(cache_key, content, validate)
+        return content
+    
+    async def achat_completion(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int | None = None,
+        bypass_cache: bool = False,
+        validate: Callable[[str], bool] | None = None,
+    ) -> str:
+        """
+        Send a chat completion request without blocking the event loop.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            temperature: Sampling temperature (0-2)
+            max_tokens: Maximum tokens to generate
+            bypass_cache: If True, always query the API (the result is still cached)
+            validate: Check that the response is usable, e.g. that it parses;
+                responses failing it are returned but never cached
             
         Returns:
             The assistant's response text
         """
+        cache_key = self._completion_cache_key(messages, temperature, max_tokens)
+        if (cached := self._cached_completion(cache_key, bypass_cache, validate)) is not None:
+            return cached
+        
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-            return response.choices[0].message.content or ""
+            content = await self._acreate_completion(messages, temperature, max_tokens)
         except Exception as e:
             console.print(f"[red]✗[/red] LLM API error: {e}")
             raise
+        
+        self._store_completion(cache_key, content, validate)
+        return content
     
     def get_embedding(self, text: str, model: str | None = None) -> list[float]:
         """
@@ -72,14 +291,31 @@ class LLMClient:
         Returns:
             Embedding vector
         """
+        return self.get_embeddings([text], model=model)[0]
+    
+    def get_embeddings(self, texts: list[str], model: str | None = None) -> list[list[float]]:
+        """
+        Get embeddings for several texts in a single OpenRouter request.
+        
+        Embeddings are not cached here; RAGSystem keeps its own cache next
+        to the index it belongs to.
+        
+        Args:
+            texts: Texts to embed
+            model: Embedding model to use (overrides env var)
+            
+        Returns:
+            Embedding vectors, in the same order as ``texts``
+        """
         embedding_model = model or os.getenv("EMBEDDING_MODEL", "openai/text-embedding-3-large")
         
         try:
-            response = self.client.embeddings.create(
-                model=embedding_model,
-                input=text,
-            )
-            return response.data[0].embedding
+            response = self._create_embeddings(embedding_model, texts)
         except Exception as e:
             console.print(f"[yellow]⚠[/yellow] External embedding failed: {e}")
             raise
+        
+        embeddings: list[list[float]] = [[] for _ in texts]
+        for item in response.data:
+            embeddings[item.index] = item.embedding
+        return embeddings
@@ -1,19 +1,50 @@
 """ExamGenie CLI - Analyze exam PDFs and generate study guides."""
 
+import asyncio
 from pathlib import Path
 
 import click
-from rich.console import Console
 
+from ._console import console
 from .llm_client import LLMClient
 from .pdf_extractor import PDFExtractor
 from .rag_system import RAGSystem
 from .topic_analyzer import TopicAnalyzer
 from .explanation_generator import ExplanationGenerator
 from .output_generator import OutputGenerator
-from .models import ExamAnalysis
+from .models import ExamAnalysis, ExamDocument, Explanation, Topic
 
-console = Console()
+
+async def _generate_content(
+    llm_client: LLMClient,
+    rag_system: RAGSystem | None,
+    exam_docs: list[ExamDocument],
+) -> tuple[list[Topic], dict[str, Explanation]]:
+    """
+    Extract topics from the exams and explain each of them.
+    
+    Both stages run on one event loop, so they share the LLM client's
+    async connection pool.
+    
+    Args:
+        llm_client: LLM client for API calls
+        rag_system: Optional RAG system for context retrieval
+        exam_docs: List of exam documents
+        
+    Returns:
+        The topic hierarchy and explanations keyed by topic path
+    """
+    # Analyze topics
+    console.print("\n[cyan]→[/cyan] Analyzing topics...")
+    analyzer = TopicAnalyzer(llm_client)
+    topics = await analyzer.analyze_exams(exam_docs)
+    
+    # Generate explanations
+    console.print("\n[cyan]→[/cyan] Generating detailed explanations...")
+    generator = ExplanationGenerator(llm_client, rag_system)
+    explanations = await generator.generate_all_explanations(topics, exam_docs)
+    
+    return topics, explanations
 
 
 @click.group()
@@ -39,7 +70,15 @@ def cli():
     "--output",
     type=click.Path(path_type=Path),
     default="study_guide.pdf",
-    help="Output PDF path",
+    help="Output file path",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["pdf", "md"]),
+    default="pdf",
+    show_default=True,
+    help="Output format (PDF or Markdown)",
 )
 @click.option(
     "--rebuild-index",
@@ -52,12 +91,19 @@ def cli():
     default=".examgenie_db",
     help="Directory for ChromaDB persistence",
 )
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Query the LLM even for requests with cached responses",
+)
 def analyze(
     exams_dir: Path,
     context_dir: Path | None,
     output: Path,
+    output_format: str,
     rebuild_index: bool,
     db_dir: Path,
+    no_cache: bool,
 ):
     """Analyze exams and generate a comprehensive study guide."""
     
@@ -66,7 +112,7 @@ def analyze(
     try:
         # Initialize components
         console.print("[cyan]→[/cyan] Initializing components...")
-        llm_client = LLMClient()
+        llm_client = LLMClient(bypass_cache=no_cache)
         
         # Initialize RAG system if context directory provided
         rag_system = None
@@ -83,15 +129,8 @@ def analyze(
             console.print("[red]✗[/red] No exam documents found!")
             return
         
-        # Analyze topics
-        console.print("\n[cyan]→[/cyan] Analyzing topics...")
-        analyzer = TopicAnalyzer(llm_client)
-        topics = analyzer.analyze_exams(exam_docs)
-        
-        # Generate explanations
-        console.print("\n[cyan]→[/cyan] Generating detailed explanations...")
-        generator = ExplanationGenerator(llm_client, rag_system)
-        explanations = generator.generate_all_explanations(topics, exam_docs)
+        # Analyze topics and generate explanations
+        topics, explanations = asyncio.run(_generate_content(llm_client, rag_system, exam_docs))
         
         # Create analysis result
         analysis = ExamAnalysis(
@@ -100,10 +139,15 @@ def analyze(
             source_exams=[doc.filename for doc in exam_docs],
         )
         
-        # Generate PDF output
-        console.print("\n[cyan]→[/cyan] Generating PDF output...")
+        # Generate output
         output_gen = OutputGenerator()
-        output_gen.generate_pdf(analysis, output)
+        if output_format == "md":
+            console.print("\n[cyan]→[/cyan] Generating Markdown output...")
+            output = output.with_suffix(".md")
+            output_gen.generate_markdown(analysis, output)
+        else:
+            console.print("\n[cyan]→[/cyan] Generating PDF output...")
+            output_gen.generate_pdf(analysis, output)
         
         console.print(f"\n[bold green]✓ Analysis complete![/bold green]")
         console.print(f"[green]Study guide saved to:[/green] {output.absolute()}")
@@ -36,6 +36,7 @@ class ExamDocument(BaseModel):
     filename: str = Field(description="Original filename")
     text: str = Field(description="Extracted text content")
     page_count: int = Field(description="Number of pages")
+    questions: list[str] = Field(default_factory=list, description="Candidate questions (blank-line separated blocks)")
 
 
 class ExamAnalysis(BaseModel):
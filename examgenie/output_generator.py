@@ -1,141 +1,408 @@
-"""PDF output generation using pypandoc."""
+"""Study guide output generation (PDF via ReportLab, or Markdown)."""
 
+from collections import deque
 from pathlib import Path
-import tempfile
+import re
+from typing import TextIO
+from xml.sax.saxutils import escape
 
-import pypandoc
-from rich.console import Console
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import (
+    Flowable,
+    ListFlowable,
+    PageBreak,
+    Paragraph,
+    SimpleDocTemplate,
+    Spacer,
+)
+from reportlab.platypus.tableofcontents import TableOfContents
 
+from ._console import console
 from .models import ExamAnalysis, Topic, Explanation
 
-console = Console()
+# Inline Markdown that LLM output commonly contains
+_MD_BOLD = re.compile(r"\*\*(.+?)\*\*")
+_MD_CODE = re.compile(r"`([^`]+)`")
+
+# Runs of anything but letters and digits become a single slug separator
+_SLUG_SEPARATORS = re.compile(r"[\W_]+")
+
+# Anchors used by fixed sections, reserved so topics cannot collide with them
+_RESERVED_SLUGS = ("table-of-contents", "source-exams")
+
+# Headings deeper than this share the smallest heading style
+_MAX_HEADING_LEVEL = 4
+
+# Only headings above this depth are listed in the table of contents
+_TOC_DEPTH = 2
+
+
+def _slugify(text: str) -> str:
+    """Convert a heading into a URL-safe anchor slug."""
+    return _SLUG_SEPARATORS.sub("-", text.lower()).strip("-") or "section"
+
+
+def _to_markup(text: str) -> str:
+    """Escape text for a ReportLab paragraph, keeping bold/code Markdown."""
+    # Code spans are cut out first, so "**" inside them (e.g. `x ** 2`)
+    # cannot open a bold tag that crosses the code font tag
+    parts: list[str] = []
+    position = 0
+    for match in _MD_CODE.finditer(text):
+        parts.append(_MD_BOLD.sub(r"<b>\1</b>", escape(text[position:match.start()])))
+        parts.append(f'<font face="Courier">{escape(match.group(1))}</font>')
+        position = match.end()
+    parts.append(_MD_BOLD.sub(r"<b>\1</b>", escape(text[position:])))
+    return "".join(parts).replace("\n", "<br/>")
+
+
+def _paragraph(text: str, style: ParagraphStyle, prefix: str = "") -> Paragraph:
+    """
+    Build a paragraph from Markdown-flavoured text.
+    
+    Args:
+        text: Paragraph text (LLM output or exam text)
+        style: Paragraph style
+        prefix: Markup placed before the text
+        
+    Returns:
+        The paragraph, rendered as plain text if its markup cannot be parsed
+    """
+    try:
+        return Paragraph(prefix + _to_markup(text), style)
+    except ValueError:
+        return Paragraph(prefix + escape(text).replace("\n", "<br/>"), style)
+
+
+class _StudyGuideDocTemplate(SimpleDocTemplate):
+    """Document template that registers headings in the TOC and PDF outline."""
+    
+    def afterFlowable(self, flowable: Flowable) -> None:
+        """Record bookmarks and TOC entries for heading paragraphs."""
+        outline_level = getattr(flowable, "outline_level", None)
+        if outline_level is None:
+            return
+        
+        text = flowable.getPlainText()
+        key = flowable.bookmark_key
+        
+        self.canv.bookmarkPage(key)
+        self.canv.addOutlineEntry(text, key, level=outline_level, closed=outline_level > 0)
+        if outline_level < _TOC_DEPTH:
+            self.notify("TOCEntry", (outline_level, escape(text), self.page, key))
 
 
 class OutputGenerator:
     """Generate PDF study guides from analysis results."""
     
-    def _topic_to_markdown(self, topic: Topic, explanations: dict[str, Explanation], level: int = 1, parent_path: str = "") -> str:
+    def __init__(self):
+        """Initialize the output generator."""
+        sample = getSampleStyleSheet()
+        
+        self.styles = {
+            "title": sample["Title"],
+            "body": sample["BodyText"],
+            "description": sample["Italic"],
+            "label": ParagraphStyle("Label", parent=sample["BodyText"], fontName="Helvetica-Bold"),
+            "quote": ParagraphStyle(
+                "Quote",
+                parent=sample["BodyText"],
+                leftIndent=18,
+                textColor="#444444",
+            ),
+        }
+        for level in range(1, _MAX_HEADING_LEVEL + 1):
+            self.styles[f"heading{level}"] = sample[f"Heading{level}"]
+        
+        # Anchor slug per topic node, keyed by id() since paths may repeat
+        self._slugs: dict[int, str] = {}
+    
+    def _build_slugs(self, topics: list[Topic]) -> None:
         """
-        Convert a topic and its explanations to markdown.
+        Assign a unique anchor slug to every topic in one tree walk.
+        
+        Duplicate headings get numbered suffixes ("intro", "intro-1", ...).
         
         Args:
-            topic: Topic to convert
+            topics: List of hierarchical topics
+        """
+        self._slugs = {}
+        used = {slug: 0 for slug in _RESERVED_SLUGS}
+        stack = deque(reversed(topics))
+        
+        while stack:
+            topic = stack.pop()
+            
+            base_slug = slug = _slugify(topic.name)
+            while slug in used:
+                used[base_slug] += 1
+                slug = f"{base_slug}-{used[base_slug]}"
+            used[slug] = 0
+            self._slugs[id(topic)] = slug
+            
+            stack.extend(reversed(topic.subtopics))
+    
+    def _heading(self, text: str, level: int, bookmark_key: str) -> Paragraph:
+        """
+        Create a heading paragraph that is registered in the TOC and outline.
+        
+        Args:
+            text: Heading text
+            level: Heading level (1 = top level)
+            bookmark_key: Unique PDF bookmark key
+            
+        Returns:
+            Heading paragraph
+        """
+        style = self.styles[f"heading{min(level, _MAX_HEADING_LEVEL)}"]
+        heading = _paragraph(text, style)
+        heading.outline_level = level - 1
+        heading.bookmark_key = bookmark_key
+        return heading
+    
+    def _topic_flowables(
+        self,
+        topic: Topic,
+        explanations: dict[str, Explanation],
+    ) -> list[Flowable]:
+        """
+        Build PDF flowables for a topic, its subtopics and their explanations.
+        
+        Args:
+            topic: Top-level topic to convert
             explanations: Dictionary of explanations
-            level: Heading level
-            parent_path: Parent topic path
             
         Returns:
-            Markdown string
+            Flowables in document order
+        """
+        body = self.styles["body"]
+        flowables: list[Flowable] = []
+        stack = deque([(topic, "", 1)])
+        
+        while stack:
+            topic, parent_path, level = stack.pop()
+            topic_path = f"{parent_path} > {topic.name}" if parent_path else topic.name
+            
+            flowables.append(self._heading(topic.name, level, self._slugs[id(topic)]))
+            
+            if topic.description:
+                flowables.append(_paragraph(topic.description, self.styles["description"]))
+            
+            # Add explanation if available
+            if topic_path in explanations:
+                explanation = explanations[topic_path]
+                
+                for paragraph in explanation.explanation.split("\n\n"):
+                    if paragraph.strip():
+                        flowables.append(_paragraph(paragraph.strip(), body))
+                
+                # Add key concepts
+                if explanation.key_concepts:
+                    flowables.append(Paragraph("Key Concepts:", self.styles["label"]))
+                    flowables.append(ListFlowable(
+                        [_paragraph(concept, body) for concept in explanation.key_concepts],
+                        bulletType="bullet",
+                    ))
+                
+                # Add examples
+                if explanation.examples:
+                    flowables.append(Paragraph("Examples:", self.styles["label"]))
+                    flowables.append(ListFlowable(
+                        [_paragraph(example, body) for example in explanation.examples],
+                        bulletType="1",
+                    ))
+                
+                # Add related questions
+                if explanation.related_questions:
+                    flowables.append(Paragraph("Example Questions:", self.styles["label"]))
+                    for question in explanation.related_questions:
+                        flowables.append(_paragraph(
+                            question.question,
+                            self.styles["quote"],
+                            prefix=f"<b>From {escape(question.source_file)}:</b><br/>",
+                        ))
+            
+            flowables.append(Spacer(1, 6))
+            
+            # Queue subtopics, reversed so they are popped in document order
+            stack.extend(
+                (subtopic, topic_path, level + 1)
+                for subtopic in reversed(topic.subtopics)
+            )
+        
+        return flowables
+    
+    def _write_topic_markdown(
+        self,
+        out: TextIO,
+        topic: Topic,
+        explanations: dict[str, Explanation],
+        level: int = 1,
+        parent_path: str = "",
+    ) -> None:
         """
-        topic_path = f"{parent_path} > {topic.name}" if parent_path else topic.name
-        heading = "#" * level
+        Write a topic, its subtopics and their explanations as markdown.
         
-        md_parts = [f"{heading} {topic.name}\n"]
+        The tree is walked with an explicit stack, so arbitrarily deep
+        hierarchies cannot hit the recursion limit.
         
-        if topic.description:
-            md_parts.append(f"*{topic.description}*\n")
+        Args:
+            out: Text stream to write to
+            topic: Topic to convert
+            explanations: Dictionary of explanations
+            level: Heading level
+            parent_path: Parent topic path
+        """
+        root_level = level
+        stack = deque([(topic, parent_path, level)])
         
-        # Add explanation if available
-        if topic_path in explanations:
-            explanation = explanations[topic_path]
+        while stack:
+            topic, parent_path, level = stack.pop()
+            topic_path = f"{parent_path} > {topic.name}" if parent_path else topic.name
+            heading = "#" * level
             
-            md_parts.append(f"\n{explanation.explanation}\n")
+            # Separate subtopics from the preceding section
+            if level > root_level:
+                out.write("\n")
             
-            # Add key concepts
-            if explanation.key_concepts:
-                md_parts.append("\n**Key Concepts:**\n")
-                for concept in explanation.key_concepts:
-                    md_parts.append(f"- {concept}\n")
+            out.write(f'<a id="{self._slugs[id(topic)]}"></a>\n\n')
+            out.write(f"{heading} {topic.name}\n")
             
-            # Add examples
-            if explanation.examples:
-                md_parts.append("\n**Examples:**\n")
-                for i, example in enumerate(explanation.examples, 1):
-                    md_parts.append(f"\n{i}. {example}\n")
+            if topic.description:
+                out.write(f"*{topic.description}*\n")
             
-            # Add related questions
-            if explanation.related_questions:
-                md_parts.append("\n**Example Questions:**\n")
-                for question in explanation.related_questions:
-                    md_parts.append(f"\n> **From {question.source_file}:**\n")
-                    md_parts.append(f"> {question.question}\n")
-        
-        # Process subtopics
-        for subtopic in topic.subtopics:
-            md_parts.append("\n")
-            md_parts.append(self._topic_to_markdown(subtopic, explanations, level + 1, topic_path))
-        
-        return "".join(md_parts)
+            # Add explanation if available
+            if topic_path in explanations:
+                explanation = explanations[topic_path]
+                
+                out.write(f"\n{explanation.explanation}\n")
+                
+                # Add key concepts
+                if explanation.key_concepts:
+                    out.write("\n**Key Concepts:**\n")
+                    for concept in explanation.key_concepts:
+                        out.write(f"- {concept}\n")
+                
+                # Add examples
+                if explanation.examples:
+                    out.write("\n**Examples:**\n")
+                    for i, example in enumerate(explanation.examples, 1):
+                        out.write(f"\n{i}. {example}\n")
+                
+                # Add related questions
+                if explanation.related_questions:
+                    out.write("\n**Example Questions:**\n")
+                    for question in explanation.related_questions:
+                        out.write(f"\n> **From {question.source_file}:**\n")
+                        out.write(f"> {question.question}\n")
+            
+            # Queue subtopics, reversed so they are popped in document order
+            stack.extend(
+                (subtopic, topic_path, level + 1)
+                for subtopic in reversed(topic.subtopics)
+            )
     
-    def generate_pdf(self, analysis: ExamAnalysis, output_path: Path) -> None:
+    def _write_markdown(self, out: TextIO, analysis: ExamAnalysis) -> None:
         """
-        Generate a PDF study guide from analysis results.
+        Write the complete study guide as markdown.
         
         Args:
+            out: Text stream to write to
             analysis: Complete exam analysis
-            output_path: Path for output PDF
         """
-        console.print("[cyan]→[/cyan] Generating study guide PDF...")
+        self._build_slugs(analysis.topics)
         
-        # Build markdown content
-        md_parts = [
-            "# Exam Study Guide\n\n",
-            f"*Generated from {len(analysis.source_exams)} exam(s)*\n\n",
-            "---\n\n",
-        ]
+        out.write("# Exam Study Guide\n\n")
+        out.write(f"*Generated from {len(analysis.source_exams)} exam(s)*\n\n")
+        out.write("---\n\n")
         
         # Add table of contents
-        md_parts.append("## Table of Contents\n\n")
+        out.write("## Table of Contents\n\n")
         for topic in analysis.topics:
-            md_parts.append(f"- [{topic.name}](#{topic.name.lower().replace(' ', '-')})\n")
+            out.write(f"- [{topic.name}](#{self._slugs[id(topic)]})\n")
             for subtopic in topic.subtopics:
-                md_parts.append(f"  - [{subtopic.name}](#{subtopic.name.lower().replace(' ', '-')})\n")
-        md_parts.append("\n---\n\n")
+                out.write(f"  - [{subtopic.name}](#{self._slugs[id(subtopic)]})\n")
+        out.write("\n---\n\n")
         
         # Add all topics and explanations
         for topic in analysis.topics:
-            md_parts.append(self._topic_to_markdown(topic, analysis.explanations))
-            md_parts.append("\n---\n\n")
+            self._write_topic_markdown(out, topic, analysis.explanations)
+            out.write("\n---\n\n")
         
         # Add source information
-        md_parts.append("## Source Exams\n\n")
+        out.write("## Source Exams\n\n")
         for exam in analysis.source_exams:
-            md_parts.append(f"- {exam}\n")
+            out.write(f"- {exam}\n")
+    
+    def generate_markdown(self, analysis: ExamAnalysis, output_path: Path) -> None:
+        """
+        Generate a Markdown study guide from analysis results.
         
-        markdown_content = "".join(md_parts)
+        Args:
+            analysis: Complete exam analysis
+            output_path: Path for output Markdown file
+        """
+        console.print("[cyan]→[/cyan] Generating study guide Markdown...")
         
-        # Write markdown to temporary file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False, encoding='utf-8') as tmp_md:
-            tmp_md.write(markdown_content)
-            tmp_md_path = tmp_md.name
+        with output_path.open("w", encoding="utf-8", buffering=1 << 20) as out:
+            self._write_markdown(out, analysis)
         
-        try:
-            # Convert markdown to PDF using pypandoc
-            pypandoc.convert_file(
-                tmp_md_path,
-                'pdf',
-                outputfile=str(output_path),
-                extra_args=[
-                    '--pdf-engine=pdflatex',
-                    '--variable', 'geometry:margin=1in',
-                    '--variable', 'fontsize=11pt',
-                    '--toc',
-                    '--toc-depth=2',
-                ],
-            )
-            
-            console.print(f"[green]✓[/green] Study guide saved to: {output_path}")
+        console.print(f"[green]✓[/green] Markdown saved to: {output_path}")
+    
+    def generate_pdf(self, analysis: ExamAnalysis, output_path: Path) -> None:
+        """
+        Generate a PDF study guide from analysis results.
+        
+        The PDF is laid out in-process with ReportLab, so no external
+        pandoc/LaTeX toolchain is required.
+        
+        Args:
+            analysis: Complete exam analysis
+            output_path: Path for output PDF
+        """
+        console.print("[cyan]→[/cyan] Generating study guide PDF...")
         
+        story: list[Flowable] = [
+            Paragraph("Exam Study Guide", self.styles["title"]),
+            Paragraph(f"Generated from {len(analysis.source_exams)} exam(s)", self.styles["description"]),
+            Spacer(1, 12),
+        ]
+        
+        # Add table of contents (filled in by the document template)
+        toc = TableOfContents()
+        story.append(Paragraph("Table of Contents", self.styles["heading2"]))
+        story.append(toc)
+        story.append(PageBreak())
+        
+        # Add all topics and explanations
+        self._build_slugs(analysis.topics)
+        for topic in analysis.topics:
+            story.extend(self._topic_flowables(topic, analysis.explanations))
+        
+        # Add source information
+        story.append(self._heading("Source Exams", 1, "source-exams"))
+        story.append(ListFlowable(
+            [Paragraph(escape(exam), self.styles["body"]) for exam in analysis.source_exams],
+            bulletType="bullet",
+        ))
+        
+        doc = _StudyGuideDocTemplate(
+            str(output_path),
+            pagesize=A4,
+            leftMargin=inch,
+            rightMargin=inch,
+            topMargin=inch,
+            bottomMargin=inch,
+            title="Exam Study Guide",
+        )
+        
+        try:
+            # Two passes: the first collects page numbers for the TOC
+            doc.multiBuild(story)
         except Exception as e:
             console.print(f"[red]✗[/red] PDF generation failed: {e}")
-            console.print(f"[yellow]⚠[/yellow] Saving markdown instead...")
-            
-            # Fallback: save as markdown
-            md_output = output_path.with_suffix('.md')
-            md_output.write_text(markdown_content, encoding='utf-8')
-            console.print(f"[green]✓[/green] Markdown saved to: {md_output}")
             raise
         
-        finally:
-            # Clean up temporary file
-            Path(tmp_md_path).unlink(missing_ok=True)
+        console.print(f"[green]✓[/green] Study guide saved to: {output_path}")
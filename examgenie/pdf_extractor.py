@@ -1,57 +1,184 @@
 """PDF text extraction module."""
 
+import hashlib
+import multiprocessing
+import os
+import re
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.metadata import version
 from pathlib import Path
 
-from pypdf import PdfReader
-from rich.console import Console
+import pypdfium2 as pdfium
+from pydantic import ValidationError
 
+from ._console import console
+from .cache import map_file
 from .models import ExamDocument
 
-console = Console()
+# Cached results are invalidated when the extraction backend changes
+_EXTRACTOR_VERSION = f"pdfium{version('pypdfium2')}"
+
+# Bump when the shape of cached ExamDocuments changes
+_CACHE_FORMAT = 2
+
+
+# A question is a block of text delimited by blank lines (or the text bounds)
+_QUESTION_BLOCK = re.compile(r"(?s)(?:^|\n)\s*(.+?)(?=\n\s*\n|\Z)")
+
+# A line break plus surrounding indentation/trailing whitespace
+_LINE_BREAK = re.compile(r"\s*\n\s*")
+
+
+def _split_questions(text: str) -> list[str]:
+    """
+    Split exam text into candidate questions (blank-line separated blocks).
+    
+    Segmentation runs in the regex engine rather than a per-line Python loop.
+    
+    Args:
+        text: Exam document text
+        
+    Returns:
+        List of question texts, each with its lines joined by spaces
+    """
+    questions: list[str] = []
+    for match in _QUESTION_BLOCK.finditer(text):
+        block = match.group(1).strip()
+        if block:
+            questions.append(_LINE_BREAK.sub(" ", block))
+    return questions
 
 
 class PDFExtractor:
     """Extract text content from PDF files."""
     
-    def extract_from_file(self, pdf_path: Path) -> ExamDocument:
+    def __init__(self, cache_dir: Path = Path(".examgenie_cache/pdf")):
+        """
+        Initialize the PDF extractor.
+        
+        Args:
+            cache_dir: Directory for cached extraction results
+        """
+        self.cache_dir = cache_dir
+    
+    def _cache_path(self, pdf_path: Path) -> Path:
+        """Get the cache file for a PDF, keyed by content hash and extractor version."""
+        with map_file(pdf_path) as content:
+            digest = hashlib.sha256(content).hexdigest()
+        return self.cache_dir / f"{digest}-{_EXTRACTOR_VERSION}-v{_CACHE_FORMAT}.json"
+    
+    def _load_cached(self, cache_path: Path, pdf_path: Path) -> ExamDocument | None:
+        """Load a cached extraction result, if present and valid."""
+        if not cache_path.exists():
+            return None
+        
+        try:
+            doc = ExamDocument.model_validate_json(cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValidationError):
+            return None
+        
+        # Identical content may have been cached under another filename
+        return doc.model_copy(update={"filename": pdf_path.name})
+    
+    def _store_cached(self, cache_path: Path, doc: ExamDocument) -> None:
+        """Write an extraction result to the cache."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Write atomically, as several workers may extract identical files
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(doc.model_dump_json(), encoding="utf-8")
+        tmp_path.replace(cache_path)
+    
+    def _needs_pool(self, cache_paths: list[Path]) -> bool:
+        """Check whether extracting files in worker processes can pay off."""
+        if len(cache_paths) < 2 or (os.cpu_count() or 1) < 2:
+            return False
+        
+        # Cache hits are cheap to load in this process
+        return not all(cache_path.exists() for cache_path in cache_paths)
+    
+    def _make_pool(self, file_count: int) -> ProcessPoolExecutor:
+        """Create a worker pool for extracting the given number of files."""
+        # Spawn fresh workers, as forking a process with running threads
+        # (embedding pools, HTTP clients) can deadlock the children
+        return ProcessPoolExecutor(
+            max_workers=min(file_count, os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    
+    def _extract_inline(self, pdf_files: list[Path], cache_paths: list[Path]) -> Iterator[ExamDocument]:
+        """Extract files one by one in this process."""
+        for pdf_path, cache_path in zip(pdf_files, cache_paths):
+            doc = self.extract_from_file(pdf_path, cache_path)
+            console.print(f"[green]✓[/green] Extracted {doc.page_count} pages from {pdf_path.name}")
+            yield doc
+    
+    def extract_from_file(self, pdf_path: Path, cache_path: Path | None = None) -> ExamDocument:
         """
         Extract text from a single PDF file.
         
+        Results are cached on disk, so unchanged files are only parsed once.
+        
         Args:
             pdf_path: Path to the PDF file
+            cache_path: Cache file for the PDF, if already computed
             
         Returns:
             ExamDocument with extracted text
         """
         try:
-            reader = PdfReader(pdf_path)
-            text_parts: list[str] = []
+            if cache_path is None:
+                cache_path = self._cache_path(pdf_path)
+            
+            cached_doc = self._load_cached(cache_path, pdf_path)
+            if cached_doc is not None:
+                return cached_doc
             
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text_parts.append(page_text)
+            # PDFium does text extraction in native code, reading the file itself
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                text_parts: list[str] = []
+                
+                for i in range(len(pdf)):
+                    page = pdf[i]
+                    textpage = page.get_textpage()
+                    page_text = textpage.get_text_range()
+                    textpage.close()
+                    page.close()
+                    
+                    if page_text:
+                        # PDFium reports CRLF line endings
+                        text_parts.append(page_text.replace("\r\n", "\n"))
+                
+                page_count = len(pdf)
+            finally:
+                pdf.close()
             
             full_text = "\n\n".join(text_parts)
             
-            return ExamDocument(
+            doc = ExamDocument(
                 filename=pdf_path.name,
                 text=full_text,
-                page_count=len(reader.pages),
+                page_count=page_count,
+                questions=_split_questions(full_text),
             )
+            self._store_cached(cache_path, doc)
+            
+            return doc
         except Exception as e:
             console.print(f"[red]✗[/red] Error extracting {pdf_path.name}: {e}")
             raise
     
-    def extract_from_directory(self, directory: Path) -> list[ExamDocument]:
+    def find_pdfs(self, directory: Path) -> list[Path]:
         """
-        Extract text from all PDF files in a directory.
+        List the PDF files in a directory, reporting what was found.
         
         Args:
             directory: Directory containing PDF files
             
         Returns:
-            List of ExamDocuments
+            Paths of the PDF files
         """
         if not directory.exists():
             raise FileNotFoundError(f"Directory not found: {directory}")
@@ -63,12 +190,61 @@ class PDFExtractor:
             return []
         
         console.print(f"[cyan]→[/cyan] Found {len(pdf_files)} PDF file(s)")
+        return pdf_files
+    
+    def extract_from_directory(self, directory: Path) -> list[ExamDocument]:
+        """
+        Extract text from all PDF files in a directory.
+        
+        Uncached files are extracted in parallel worker processes.
+        
+        Args:
+            directory: Directory containing PDF files
+            
+        Returns:
+            List of ExamDocuments
+        """
+        pdf_files = self.find_pdfs(directory)
+        if not pdf_files:
+            return []
+        
+        cache_paths = [self._cache_path(pdf_path) for pdf_path in pdf_files]
+        if not self._needs_pool(cache_paths):
+            return list(self._extract_inline(pdf_files, cache_paths))
         
         documents: list[ExamDocument] = []
-        for pdf_path in pdf_files:
-            console.print(f"[cyan]→[/cyan] Extracting: {pdf_path.name}")
-            doc = self.extract_from_file(pdf_path)
-            documents.append(doc)
-            console.print(f"[green]✓[/green] Extracted {doc.page_count} pages from {pdf_path.name}")
+        with self._make_pool(len(pdf_files)) as executor:
+            results = executor.map(self.extract_from_file, pdf_files, cache_paths)
+            for pdf_path, doc in zip(pdf_files, results):
+                documents.append(doc)
+                console.print(f"[green]✓[/green] Extracted {doc.page_count} pages from {pdf_path.name}")
         
         return documents
+    
+    def iter_from_files(self, pdf_files: list[Path]) -> Iterator[ExamDocument]:
+        """
+        Extract text from the given PDF files, yielding each as it finishes.
+        
+        Args:
+            pdf_files: Paths of the PDF files
+            
+        Yields:
+            ExamDocuments, in the order they finish extracting
+        """
+        if not pdf_files:
+            return
+        
+        cache_paths = [self._cache_path(pdf_path) for pdf_path in pdf_files]
+        if not self._needs_pool(cache_paths):
+            yield from self._extract_inline(pdf_files, cache_paths)
+            return
+        
+        with self._make_pool(len(pdf_files)) as executor:
+            futures = [
+                executor.submit(self.extract_from_file, pdf_path, cache_path)
+                for pdf_path, cache_path in zip(pdf_files, cache_paths)
+            ]
+            for future in as_completed(futures):
+                doc = future.result()
+                console.print(f"[green]✓[/green] Extracted {doc.page_count} pages from {doc.filename}")
+                yield doc
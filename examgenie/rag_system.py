@@ -1,17 +1,119 @@
 """RAG system for context document embeddings and retrieval."""
 
+import functools
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
-import chromadb
-from chromadb.config import Settings
-from rich.console import Console
-from sentence_transformers import SentenceTransformer
+import numpy as np
+import orjson
+from blake3 import blake3
 
+from ._console import console
+from .cache import DiskCache, map_file
 from .llm_client import LLMClient
 from .pdf_extractor import PDFExtractor
+from .tokens import CHARS_PER_TOKEN, count_tokens, token_encoding
 
-console = Console()
+# chromadb, torch and sentence-transformers take seconds to import, so they
+# are imported where used; importing this module (as the CLI and every PDF
+# worker process do) stays cheap
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# Per-request limits of the embeddings endpoint (OpenAI caps at 300K tokens
+# and 2048 inputs); token counts are estimates, so leave some headroom
+_MAX_BATCH_TOKENS = 250_000
+_MAX_BATCH_INPUTS = 2048
+
+# Fingerprints (mtime, size, content hash) of the indexed context PDFs
+_MANIFEST_NAME = "manifest.json"
+
+# Cached embeddings are stored at half precision: a fraction of the size of
+# JSON floats, and well within what nearest-neighbour ranking can resolve
+_CACHE_DTYPE = np.float16
+
+# Texts per forward pass for local embedding models
+_LOCAL_ENCODE_BATCH_SIZE = 256
+
+
+def _hash_file(path: Path) -> str:
+    """
+    Hash a file's content.
+    
+    Args:
+        path: File to hash
+        
+    Returns:
+        Hex-encoded BLAKE3 digest
+    """
+    with map_file(path) as content:
+        return blake3(content).hexdigest()
+
+
+@functools.lru_cache(maxsize=4)
+def _load_st_model(model_name: str, device: str, half: bool) -> "SentenceTransformer":
+    """
+    Load a SentenceTransformer model once per process.
+    
+    Args:
+        model_name: Model name on the Hugging Face hub
+        device: Device to run the model on
+        half: Whether to convert the model to half precision
+        
+    Returns:
+        The shared model instance
+    """
+    from sentence_transformers import SentenceTransformer
+    
+    model = SentenceTransformer(model_name, device=device)
+    if half:
+        model.half()
+    return model
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale each row of a matrix to unit length.
+    
+    Args:
+        vectors: Embedding matrix, one vector per row
+        
+    Returns:
+        Matrix of L2-normalized rows (all-zero rows are left as-is)
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _hnsw_params(n_expected: int) -> dict[str, int]:
+    """
+    Choose HNSW graph parameters for the expected number of vectors.
+    
+    Chroma's defaults (M=16, ef_construction=100, ef_search=10) give poor
+    recall on larger collections; denser graphs and wider searches keep
+    recall high as the index grows.
+    
+    Args:
+        n_expected: Number of vectors the collection will hold
+        
+    Returns:
+        Collection metadata entries for the HNSW index
+    """
+    if n_expected < 100_000:
+        m, construction_ef, search_ef = 16, 64, 40
+    elif n_expected < 1_000_000:
+        m, construction_ef, search_ef = 24, 100, 100
+    else:
+        m, construction_ef, search_ef = 32, 128, 200
+    
+    return {
+        "hnsw:M": m,
+        "hnsw:construction_ef": construction_ef,
+        "hnsw:search_ef": search_ef,
+    }
 
 
 class RAGSystem:
@@ -25,6 +127,9 @@ class RAGSystem:
             persist_directory: Directory to persist ChromaDB data
             llm_client: LLM client for embeddings
         """
+        import chromadb
+        from chromadb.config import Settings
+        
         self.persist_directory = persist_directory
         self.llm_client = llm_client
         self.embedding_model_name = os.getenv("EMBEDDING_MODEL", "openai/text-embedding-3-large")
@@ -41,29 +146,225 @@ class RAGSystem:
             )
             self.local_model = None
         else:
+            import torch
+            
             console.print(f"[cyan]→[/cyan] Using local embeddings: {self.embedding_model_name}")
             # Extract model name after "sentence-transformers/"
             model_name = self.embedding_model_name.replace("sentence-transformers/", "")
-            self.local_model = SentenceTransformer(model_name)
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            # Half precision roughly doubles GPU throughput, but costs some
+            # recall on smaller models, so it is opt-in
+            half = device == "cuda" and os.getenv("EMBED_FP16") == "1"
+            self.local_model = _load_st_model(model_name, device, half)
+            console.print(f"[cyan]→[/cyan] Local embedding device: {device}")
             self.client = chromadb.PersistentClient(
                 path=str(persist_directory),
                 settings=Settings(anonymized_telemetry=False),
             )
         
         self.collection_name = "context_documents"
-        self.chunk_size = 1000  # Characters per chunk
-        self.chunk_overlap = 200  # Overlap between chunks
+        # Chunks are cut on token boundaries, sized to the embedding model's input
+        self.chunk_tokens = 512  # Tokens per chunk
+        if self.local_model is not None:
+            # The model's limit includes the special tokens it adds ([CLS], [SEP])
+            max_text_tokens = (
+                self.local_model.max_seq_length
+                - self.local_model.tokenizer.num_special_tokens_to_add()
+            )
+            self.chunk_tokens = min(self.chunk_tokens, max_text_tokens)
+        self.chunk_overlap_tokens = min(64, self.chunk_tokens // 4)  # Overlap between chunks
+        self._token_stride = self.chunk_tokens - self.chunk_overlap_tokens
+        
+        # Character-based fallback when no tokenizer is available
+        self.chunk_size = self.chunk_tokens * CHARS_PER_TOKEN
+        self.chunk_overlap = self.chunk_overlap_tokens * CHARS_PER_TOKEN
+        self._chunk_stride = self.chunk_size - self.chunk_overlap
+        self._collection = None  # Resolved lazily, reset when the index is rebuilt
+        
+        # Repeated queries skip the embedding call and the HNSW search; results
+        # are cleared whenever the index changes
+        self._embed_query = functools.lru_cache(maxsize=1024)(self._get_embedding)
+        self._search_cached = functools.lru_cache(maxsize=1024)(self._search_uncached)
+        
+        # Embeddings of previously seen texts, kept across rebuilds
+        self._embedding_cache = DiskCache(persist_directory / "embedding_cache.sqlite")
+        
+        # External embedding requests are latency-bound, so keep several batches in flight
+        self._embed_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv("EMBED_CONCURRENCY", "8")),
+        )
     
     def _get_embedding(self, text: str) -> list[float]:
         """Get embedding for text using configured model."""
-        if self.use_external_embeddings:
-            return self.llm_client.get_embedding(text)
-        else:
-            return self.local_model.encode(text).tolist()
+        return self._embed_texts([text])[0]
+    
+    def _embedding_cache_key(self, text: str) -> str:
+        """Build the embedding cache key for a text under the configured model."""
+        digest = blake3(text.encode("utf-8")).hexdigest()
+        return f"{self.embedding_model_name}:{np.dtype(_CACHE_DTYPE).name}:{digest}"
+    
+    def _embed_texts(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed texts with the configured model, reusing cached embeddings.
+        
+        Only texts without a cached embedding are sent to the model. Vectors
+        are L2-normalized, so inner product ranks them like cosine similarity.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            Unit-length embedding vectors, in the same order as ``texts``
+        """
+        cache_keys = [self._embedding_cache_key(text) for text in texts]
+        found = self._embedding_cache.get_many(cache_keys)
+        
+        missing = [i for i, cache_key in enumerate(cache_keys) if cache_key not in found]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            if self.use_external_embeddings:
+                new_embeddings = self._get_embeddings_batch(missing_texts)
+            else:
+                new_embeddings = self._encode_local(missing_texts)
+            
+            new_values = [
+                (cache_keys[i], vector.tobytes())
+                for i, vector in zip(missing, np.asarray(new_embeddings, dtype=_CACHE_DTYPE))
+            ]
+            self._embedding_cache.set_many(new_values)
+            found.update(new_values)
+        
+        if not texts:
+            return []
+        
+        # Fresh and cached vectors are read back the same way, so results
+        # don't depend on whether a vector came from the cache
+        vectors = np.stack([
+            np.frombuffer(found[cache_key], dtype=_CACHE_DTYPE)
+            for cache_key in cache_keys
+        ]).astype(np.float32)
+        return _normalize(vectors).tolist()
+    
+    def _encode_local(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed texts with the local SentenceTransformer model.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            L2-normalized embedding vectors, in the same order as ``texts``
+        """
+        return self.local_model.encode(
+            texts,
+            batch_size=_LOCAL_ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        ).tolist()
+    
+    def _token_batches(self, texts: list[str]) -> list[list[str]]:
+        """
+        Group texts into batches that fit within one embeddings request.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            Consecutive batches of ``texts``, in order
+        """
+        batches: list[list[str]] = []
+        current: list[str] = []
+        current_tokens = 0
+        
+        for text in texts:
+            tokens = count_tokens(text)
+            if current and (current_tokens + tokens > _MAX_BATCH_TOKENS or len(current) >= _MAX_BATCH_INPUTS):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(text)
+            current_tokens += tokens
+        
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        """Embed one request-sized batch, falling back to per-text requests if it is rejected."""
+        try:
+            return self.llm_client.get_embeddings(texts)
+        except Exception:
+            if len(texts) == 1:
+                raise
+            console.print(f"[yellow]⚠[/yellow] Batch embedding failed, retrying {len(texts)} chunks individually")
+            return [self.llm_client.get_embedding(text) for text in texts]
+    
+    def _get_embeddings_batch(self, texts: list[str]) -> list[list[float]]:
+        """
+        Get embeddings for many texts using the provider's batch endpoint.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            Embedding vectors, in the same order as ``texts``
+        """
+        batches = self._token_batches(texts)
+        return [
+            embedding
+            for batch_embeddings in self._embed_pool.map(self._embed_batch, batches)
+            for embedding in batch_embeddings
+        ]
+    
+    def _load_manifest(self) -> dict[str, dict[str, Any]]:
+        """Load the fingerprints of indexed files (empty if there are none yet)."""
+        try:
+            return orjson.loads((self.persist_directory / _MANIFEST_NAME).read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return {}
+    
+    def _save_manifest(self, manifest: dict[str, dict[str, Any]]) -> None:
+        """Write the fingerprints of indexed files atomically."""
+        manifest_path = self.persist_directory / _MANIFEST_NAME
+        tmp_path = manifest_path.with_suffix(".tmp")
+        tmp_path.write_bytes(orjson.dumps(manifest))
+        tmp_path.replace(manifest_path)
+    
+    def _token_starts(self, text: str) -> list[int] | None:
+        """
+        Find where each token of the embedding model's tokenizer starts in a text.
+        
+        Args:
+            text: Text to tokenize
+            
+        Returns:
+            Character offset of every token, or None if no tokenizer is available
+        """
+        if self.local_model is not None:
+            try:
+                encoding = self.local_model.tokenizer(
+                    text,
+                    add_special_tokens=False,
+                    return_offsets_mapping=True,
+                    verbose=False,
+                )
+            except Exception:
+                return None  # Tokenizers without offset support
+            return [start for start, _ in encoding["offset_mapping"]]
+        
+        encoding = token_encoding()
+        if encoding is None:
+            return None
+        _, starts = encoding.decode_with_offsets(encoding.encode_ordinary(text))
+        return starts
     
     def _chunk_text(self, text: str) -> list[str]:
         """
-        Split text into overlapping chunks.
+        Split text into overlapping chunks on token boundaries.
+        
+        Falls back to fixed-size character windows if the text cannot be
+        tokenized.
         
         Args:
             text: Text to chunk
@@ -71,21 +372,35 @@ class RAGSystem:
         Returns:
             List of text chunks
         """
-        chunks: list[str] = []
-        start = 0
+        starts = self._token_starts(text)
+        if starts is None:
+            return [
+                text[start:start + self.chunk_size]
+                for start in range(0, len(text), self._chunk_stride)
+            ]
         
-        while start < len(text):
-            end = start + self.chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start += self.chunk_size - self.chunk_overlap
+        token_count = len(starts)
+        if token_count == 0:
+            return []
         
-        return chunks
+        # Each window runs up to where the token after it begins, so text
+        # between tokens (e.g. whitespace) stays in the chunk
+        starts.append(len(text))
+        last_start = max(token_count - self.chunk_overlap_tokens, 1)
+        return [
+            text[starts[first]:starts[min(first + self.chunk_tokens, token_count)]]
+            for first in range(0, last_start, self._token_stride)
+        ]
     
     def index_documents(self, context_dir: Path, rebuild: bool = False) -> None:
         """
         Index context documents from a directory.
         
+        Only PDFs that are new or whose content changed since the last run
+        are extracted and embedded; chunks of changed or deleted files are
+        replaced or removed. Fingerprints of indexed files are kept in
+        ``manifest.json`` in the persist directory.
+        
         Args:
             context_dir: Directory containing context PDFs
             rebuild: If True, rebuild the index from scratch
@@ -94,89 +409,145 @@ class RAGSystem:
             console.print(f"[yellow]⚠[/yellow] Context directory not found: {context_dir}")
             return
         
-        # Get or create collection
         try:
             if rebuild:
+                existing = None
                 try:
+                    self._collection = None
+                    self._search_cached.cache_clear()
                     self.client.delete_collection(self.collection_name)
                     console.print("[cyan]→[/cyan] Deleted existing collection")
                 except Exception:
                     pass
-            
-            # Create collection with custom embedding function if using external
-            if self.use_external_embeddings:
-                collection = self.client.get_or_create_collection(
-                    name=self.collection_name,
-                    metadata={"hnsw:space": "cosine"},
-                )
             else:
-                collection = self.client.get_or_create_collection(
-                    name=self.collection_name,
-                    metadata={"hnsw:space": "cosine"},
-                )
+                try:
+                    existing = self.client.get_collection(self.collection_name)
+                except Exception:
+                    existing = None
             
-            # Check if already indexed
-            if collection.count() > 0 and not rebuild:
-                console.print(f"[green]✓[/green] Using existing index with {collection.count()} chunks")
-                return
+            # The manifest only describes a collection that still exists
+            manifest = self._load_manifest() if existing is not None else {}
             
-            # Extract PDFs
             extractor = PDFExtractor()
-            documents = extractor.extract_from_directory(context_dir)
+            pdf_files = extractor.find_pdfs(context_dir)
             
-            if not documents:
+            # Compare each file with the fingerprint it was indexed under; the
+            # content is only hashed when its size or mtime has changed
+            fingerprints: dict[str, dict[str, Any]] = {}
+            changed: list[Path] = []
+            for pdf_path in pdf_files:
+                stat = pdf_path.stat()
+                entry = manifest.get(pdf_path.name)
+                if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                    fingerprints[pdf_path.name] = entry
+                    continue
+                
+                file_hash = _hash_file(pdf_path)
+                fingerprints[pdf_path.name] = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": file_hash}
+                if entry is None or entry["hash"] != file_hash:
+                    changed.append(pdf_path)
+            
+            removed = [filename for filename in manifest if filename not in fingerprints]
+            
+            if existing is not None:
+                self._collection = existing
+                
+                if not changed and not removed:
+                    if fingerprints != manifest:
+                        self._save_manifest(fingerprints)  # Touched but unmodified files
+                    console.print(f"[green]✓[/green] Using existing index with {existing.count()} chunks")
+                    return
+                
+                # Drop the chunks of files that changed or disappeared
+                for filename in [*removed, *(pdf_path.name for pdf_path in changed)]:
+                    existing.delete(where={"filename": filename})
+                self._search_cached.cache_clear()
+                
+                if removed:
+                    console.print(f"[cyan]→[/cyan] Removed {len(removed)} deleted document(s) from the index")
+                if not changed:
+                    self._save_manifest(fingerprints)
+                    return
+            
+            if not changed:
                 return
             
             console.print("[cyan]→[/cyan] Chunking and embedding documents...")
             
-            # Process each document
-            all_chunks: list[str] = []
-            all_metadatas: list[dict[str, str]] = []
-            all_ids: list[str] = []
-            
-            for doc in documents:
-                chunks = self._chunk_text(doc.text)
-                for i, chunk in enumerate(chunks):
-                    all_chunks.append(chunk)
-                    all_metadatas.append({
-                        "filename": doc.filename,
-                        "chunk_index": str(i),
-                    })
-                    all_ids.append(f"{doc.filename}_{i}")
-            
-            # Generate embeddings and add to collection
-            console.print(f"[cyan]→[/cyan] Generating embeddings for {len(all_chunks)} chunks...")
-            
-            # Process in batches to avoid memory issues
-            batch_size = 100
-            for i in range(0, len(all_chunks), batch_size):
-                batch_chunks = all_chunks[i:i + batch_size]
-                batch_metadatas = all_metadatas[i:i + batch_size]
-                batch_ids = all_ids[i:i + batch_size]
+            # Chunks are kept per document; ids and metadata are only built
+            # for the slice being inserted
+            pending: list[tuple[str, list[str], Future[list[list[float]]]]] = []
+            chunk_count = 0
+            
+            # Each document is chunked and handed to the embedding stage as soon
+            # as it is extracted, while the remaining PDFs are still being parsed
+            with ThreadPoolExecutor(max_workers=1) as embed_stage:
+                for doc in extractor.iter_from_files(changed):
+                    chunks = self._chunk_text(doc.text)
+                    chunk_count += len(chunks)
+                    pending.append((doc.filename, chunks, embed_stage.submit(self._embed_texts, chunks)))
+                
+                if not pending:
+                    return
                 
-                # Generate embeddings
-                if self.use_external_embeddings:
-                    # For external, we need to embed one at a time (API limitation)
-                    batch_embeddings = [self._get_embedding(chunk) for chunk in batch_chunks]
+                if existing is not None:
+                    collection = existing
                 else:
-                    # Local model can batch
-                    batch_embeddings = self.local_model.encode(batch_chunks).tolist()
+                    # HNSW parameters are fixed at creation, so size them for the corpus
+                    collection = self.client.get_or_create_collection(
+                        name=self.collection_name,
+                        # Embeddings are unit length, so inner product ranks like cosine
+                        # without normalizing on every distance computation
+                        metadata={"hnsw:space": "ip", **_hnsw_params(chunk_count)},
+                    )
+                    self._collection = collection
+                    self._search_cached.cache_clear()
                 
-                collection.add(
-                    embeddings=batch_embeddings,
-                    documents=batch_chunks,
-                    metadatas=batch_metadatas,
-                    ids=batch_ids,
-                )
+                console.print(f"[cyan]→[/cyan] Generating embeddings for {chunk_count} chunks...")
                 
-                console.print(f"[cyan]→[/cyan] Indexed {min(i + batch_size, len(all_chunks))}/{len(all_chunks)} chunks")
+                # Insert each document as soon as its embeddings are ready, while
+                # the embedding stage is already working on the next one
+                max_batch_size = self.client.get_max_batch_size()
+                for filename, chunks, future in pending:
+                    embeddings = future.result()
+                    for start in range(0, len(chunks), max_batch_size):
+                        indices = range(start, min(start + max_batch_size, len(chunks)))
+                        collection.add(
+                            embeddings=embeddings[start:indices.stop],
+                            documents=chunks[start:indices.stop],
+                            metadatas=[{"filename": filename, "chunk_index": str(i)} for i in indices],
+                            ids=[f"{filename}_{i}" for i in indices],
+                        )
+            
+            self._save_manifest(fingerprints)
+            console.print(f"[green]✓[/green] Indexed {chunk_count} chunks from {len(pending)} documents")
             
-            console.print(f"[green]✓[/green] Indexed {len(all_chunks)} chunks from {len(documents)} documents")
+            if existing is not None:
+                # HNSW parameters cannot be changed after creation, so growing
+                # past a size band needs a rebuild to pick up the larger graph
+                created_m = (existing.metadata or {}).get("hnsw:M", 16)
+                if _hnsw_params(existing.count())["hnsw:M"] != created_m:
+                    console.print(
+                        "[yellow]⚠[/yellow] Index has outgrown its HNSW settings; "
+                        "run with --rebuild-index to keep search recall high"
+                    )
         
         except Exception as e:
             console.print(f"[red]✗[/red] Error indexing documents: {e}")
             raise
     
+    def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        """
+        Embed several search queries at once.
+        
+        Args:
+            queries: Search queries
+            
+        Returns:
+            Query embeddings, in the same order as ``queries``
+        """
+        return self._embed_texts(queries)
+    
     def search(self, query: str, top_k: int = 5) -> list[str]:
         """
         Search for relevant context chunks.
@@ -189,22 +560,53 @@ class RAGSystem:
             List of relevant text chunks
         """
         try:
-            collection = self.client.get_collection(self.collection_name)
-            
-            # Generate query embedding
-            query_embedding = self._get_embedding(query)
-            
-            # Search
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k,
-            )
-            
-            # Extract documents
-            if results["documents"] and len(results["documents"]) > 0:
-                return results["documents"][0]
-            return []
-        
+            return list(self._search_cached(query, top_k))
         except Exception as e:
             console.print(f"[yellow]⚠[/yellow] Search error: {e}")
             return []
+    
+    def search_many(self, queries: list[str], top_k: int = 5) -> list[list[str]]:
+        """
+        Search for relevant context chunks for several queries at once.
+        
+        All queries are embedded in one batch and looked up in a single
+        collection query, instead of one round-trip per query. Unlike
+        ``search``, errors are raised, so callers can fall back to searching
+        query by query.
+        
+        Args:
+            queries: Search queries
+            top_k: Number of results to return per query
+            
+        Returns:
+            Lists of relevant text chunks, in the same order as ``queries``
+        """
+        if not queries:
+            return []
+        
+        return self._query_collection(self.embed_queries(queries), top_k)
+    
+    def _search_uncached(self, query: str, top_k: int) -> tuple[str, ...]:
+        """Embed a query and search the collection (memoized per instance as ``_search_cached``)."""
+        query_embedding = self._embed_query(query)
+        return tuple(self._query_collection([query_embedding], top_k)[0])
+    
+    def _query_collection(self, query_embeddings: list[list[float]], top_k: int) -> list[list[str]]:
+        """
+        Run a nearest-neighbour query against the collection.
+        
+        Args:
+            query_embeddings: Unit-length query embeddings
+            top_k: Number of results to return per query
+            
+        Returns:
+            Matching text chunks for each query embedding
+        """
+        if self._collection is None:
+            self._collection = self.client.get_collection(self.collection_name)
+        
+        results = self._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=top_k,
+        )
+        return results["documents"] or [[] for _ in query_embeddings]
@@ -0,0 +1,44 @@
+"""Approximate token counting for prompt budgeting."""
+
+import functools
+
+import tiktoken
+
+from ._console import console
+
+# Rough characters-per-token ratio used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+
+@functools.cache
+def token_encoding() -> tiktoken.Encoding | None:
+    """
+    Load the tokenizer used to estimate prompt sizes.
+    
+    OpenRouter models use a variety of tokenizers; cl100k_base is a close
+    enough approximation for budgeting purposes.
+    
+    Returns:
+        The encoding, or None if it cannot be loaded (e.g. offline first run)
+    """
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        console.print(f"[yellow]⚠[/yellow] Tokenizer unavailable, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text.
+    
+    Args:
+        text: Text to measure
+    
+    Returns:
+        Token count (exact for cl100k_base, otherwise a character-based estimate)
+    """
+    encoding = token_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+    return len(encoding.encode_ordinary(text))
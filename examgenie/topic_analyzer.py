@@ -1,46 +1,19 @@
 """Topic extraction and hierarchical structuring."""
 
-import json
-from rich.console import Console
+import asyncio
+import os
+import re
+from typing import Final
 
+import orjson
+
+from ._console import console
+from .json_utils import extract_json
 from .llm_client import LLMClient
 from .models import ExamDocument, Topic
+from .tokens import count_tokens
 
-console = Console()
-
-
-class TopicAnalyzer:
-    """Extract and structure topics from exam documents."""
-    
-    def __init__(self, llm_client: LLMClient):
-        """
-        Initialize the topic analyzer.
-        
-        Args:
-            llm_client: LLM client for API calls
-        """
-        self.llm_client = llm_client
-    
-    def analyze_exams(self, exam_docs: list[ExamDocument]) -> list[Topic]:
-        """
-        Analyze exam documents and extract hierarchical topics.
-        
-        Args:
-            exam_docs: List of exam documents
-            
-        Returns:
-            List of hierarchical topics
-        """
-        console.print("[cyan]→[/cyan] Analyzing exams to extract topics...")
-        
-        # Combine all exam texts
-        combined_text = "\n\n---\n\n".join([
-            f"EXAM: {doc.filename}\n{doc.text}"
-            for doc in exam_docs
-        ])
-        
-        # Create prompt for topic extraction
-        system_prompt = """You are an expert academic analyst. Your task is to analyze university exam questions and extract a comprehensive, hierarchical list of all topics and concepts covered.
+_SYSTEM_PROMPT: Final[str] = """You are an expert academic analyst. Your task is to analyze university exam questions and extract a comprehensive, hierarchical list of all topics and concepts covered.
 
 For each topic:
 1. Identify the main topic area
@@ -66,6 +39,123 @@ Return your response as a JSON array of topics with this structure:
 
 Be thorough and comprehensive. Include all concepts, theories, methods, and techniques mentioned or implied by the exam questions."""
 
+# Separator between exams in a prompt
+_EXAM_SEPARATOR = "\n\n---\n\n"
+
+# Runs of whitespace, collapsed when comparing topic names
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize_name(name: str) -> str:
+    """Normalize a topic name for matching across analysis requests."""
+    return _WHITESPACE.sub(" ", name).strip().casefold()
+
+
+def _parse_topics(response: str) -> list[Topic]:
+    """
+    Parse the topic array from an analysis response.
+    
+    Args:
+        response: Raw response text (extra text around the JSON is ignored)
+        
+    Returns:
+        List of hierarchical topics
+    """
+    return [Topic(**topic_dict) for topic_dict in orjson.loads(extract_json(response, "["))]
+
+
+def _is_topic_response(response: str) -> bool:
+    """Check whether an analysis response parses, so it is safe to cache."""
+    try:
+        _parse_topics(response)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+def _merge_topics(topic_lists: list[list[Topic]]) -> list[Topic]:
+    """
+    Merge topic lists, combining topics whose names match.
+    
+    The first occurrence of a topic keeps its name and description; the
+    subtopics of all occurrences are merged the same way.
+    
+    Args:
+        topic_lists: Topic lists extracted from different exam groups
+        
+    Returns:
+        Merged list of topics, in order of first appearance
+    """
+    merged: dict[str, Topic] = {}
+    for topics in topic_lists:
+        for topic in topics:
+            key = _normalize_name(topic.name)
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = topic
+            else:
+                merged[key] = existing.model_copy(update={
+                    "subtopics": _merge_topics([existing.subtopics, topic.subtopics]),
+                })
+    return list(merged.values())
+
+
+class TopicAnalyzer:
+    """Extract and structure topics from exam documents."""
+    
+    def __init__(self, llm_client: LLMClient):
+        """
+        Initialize the topic analyzer.
+        
+        Args:
+            llm_client: LLM client for API calls
+        """
+        self.llm_client = llm_client
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.max_group_tokens = int(os.getenv("TOPIC_GROUP_TOKENS", "8000"))
+    
+    def _group_documents(self, exam_docs: list[ExamDocument]) -> list[list[str]]:
+        """
+        Group exam texts into prompts of roughly ``max_group_tokens`` tokens.
+        
+        An exam larger than the budget gets a group of its own.
+        
+        Args:
+            exam_docs: List of exam documents
+            
+        Returns:
+            Groups of formatted exam sections, in document order
+        """
+        groups: list[list[str]] = []
+        current: list[str] = []
+        current_tokens = 0
+        
+        for doc in exam_docs:
+            section = f"EXAM: {doc.filename}\n{doc.text}"
+            tokens = count_tokens(section)
+            if current and current_tokens + tokens > self.max_group_tokens:
+                groups.append(current)
+                current = []
+                current_tokens = 0
+            current.append(section)
+            current_tokens += tokens
+        
+        if current:
+            groups.append(current)
+        return groups
+    
+    async def _extract_topics(self, sections: list[str]) -> list[Topic]:
+        """
+        Extract topics from one group of exams.
+        
+        Args:
+            sections: Formatted exam sections to analyze together
+            
+        Returns:
+            List of hierarchical topics found in these exams
+        """
+        combined_text = _EXAM_SEPARATOR.join(sections)
+        
         user_prompt = f"""Analyze the following exam questions and extract all topics in a hierarchical structure:
 
 {combined_text}
@@ -73,32 +163,54 @@ Be thorough and comprehensive. Include all concepts, theories, methods, and tech
 Return ONLY the JSON array, no additional text."""
 
         # Call LLM
-        response = self.llm_client.chat_completion(
+        response = await self.llm_client.achat_completion(
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": _SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt},
             ],
             temperature=0.3,  # Lower temperature for more consistent structure
+            validate=_is_topic_response,
         )
         
-        # Parse JSON response
+        # Parse JSON response (in case there's extra text around it)
         try:
-            # Extract JSON from response (in case there's extra text)
-            json_start = response.find("[")
-            json_end = response.rfind("]") + 1
-            json_str = response[json_start:json_end]
-            
-            topics_data = json.loads(json_str)
-            topics = [Topic(**topic_dict) for topic_dict in topics_data]
-            
-            console.print(f"[green]✓[/green] Extracted {len(topics)} main topics")
-            return topics
-        
-        except json.JSONDecodeError as e:
+            return _parse_topics(response)
+        except orjson.JSONDecodeError as e:
             console.print(f"[red]✗[/red] Failed to parse topic JSON: {e}")
             console.print(f"[yellow]Response:[/yellow] {response[:500]}")
             raise
     
+    async def analyze_exams(self, exam_docs: list[ExamDocument]) -> list[Topic]:
+        """
+        Analyze exam documents and extract hierarchical topics.
+        
+        Exams are split into groups of about ``max_group_tokens`` tokens
+        (``TOPIC_GROUP_TOKENS`` env var) that are analyzed concurrently; the
+        resulting topic lists are merged by name.
+        
+        Args:
+            exam_docs: List of exam documents
+            
+        Returns:
+            List of hierarchical topics
+        """
+        console.print("[cyan]→[/cyan] Analyzing exams to extract topics...")
+        
+        groups = self._group_documents(exam_docs)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def process_group(sections: list[str]) -> list[Topic]:
+            async with semaphore:
+                return await self._extract_topics(sections)
+        
+        topic_lists = await asyncio.gather(*[process_group(sections) for sections in groups])
+        
+        # A single response is used as-is, so results match a one-shot analysis
+        topics = topic_lists[0] if len(topic_lists) == 1 else _merge_topics(topic_lists)
+        
+        console.print(f"[green]✓[/green] Extracted {len(topics)} main topics from {len(groups)} exam group(s)")
+        return topics
+    
     def get_all_topic_paths(self, topics: list[Topic]) -> list[str]:
         """
         Get all topic paths (including nested subtopics) as flat list.
@@ -111,14 +223,13 @@ Return ONLY the JSON array, no additional text."""
         """
         paths: list[str] = []
         
-        def traverse(topic: Topic, parent_path: str = ""):
+        # Depth-first with an explicit stack; children are pushed in reverse
+        # so paths come out in document order
+        stack: list[tuple[Topic, str]] = [(topic, "") for topic in reversed(topics)]
+        while stack:
+            topic, parent_path = stack.pop()
             current_path = f"{parent_path} > {topic.name}" if parent_path else topic.name
             paths.append(current_path)
-            
-            for subtopic in topic.subtopics:
-                traverse(subtopic, current_path)
-        
-        for topic in topics:
-            traverse(topic)
+            stack.extend((subtopic, current_path) for subtopic in reversed(topic.subtopics))
         
         return paths